@@ -24,10 +24,6 @@ def infer_type(name):
 
     raise click.ClickException(f"Can't infer file type from name: {name}")
 
-class msb_file(list):
-    def to_json(self):
-        return [x.to_json() for x in self]
-
 @melatool.command()
 @click.argument("input", type=click.File("rb"))
 @click.argument("output", default="-", type=click.File("wb"))
@@ -46,7 +42,17 @@ def convert(input, output, from_type, to_type):
 
     if to_type == "json":
         if from_type == "msb":
-            x = msb_file(read_msb(input))
+            # records are converted to json text one at a time, msb files can get big.
+            # the whole input is read before the first write though, so a truncated or
+            # corrupt file fails without leaving half a json file behind.
+            recs = [json.dumps(rec.to_json()).encode("utf8") for rec in read_msb(input)]
+            output.write(b"[")
+            for i, r in enumerate(recs):
+                if i:
+                    output.write(b", ")
+                output.write(r)
+            output.write(b"]\n")
+            return
 
         if from_type == "par":
             from melatools.par_parse import read_par
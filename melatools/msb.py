@@ -1,5 +1,6 @@
 import struct
 import math
+from array import array
 from melatools.rsd import RsdInitialDataRecord
 
 # MELA Standard Binary (MSB)
@@ -8,12 +9,34 @@ from melatools.rsd import RsdInitialDataRecord
 class MsbError(Exception): pass
 class MsbEof(MsbError): pass
 
+def check_finite(buf):
+    # nan and inf survive addition, so one summing pass in C tells if anything is off.
+    # only then look for the culprit (the sum may also just have overflowed).
+    if not math.isfinite(sum(buf)):
+        for f in buf:
+            if not math.isfinite(f):
+                raise MsbError(f"Non-finite floating point: {f}")
+
+def fpint(f):
+    i = int(f)
+    if i != f:
+        raise MsbError(f"Unexpected non-integer floating point: {f}")
+    return i
+
 class MsbFormat:
 
     def __init__(self, uid_type="d", float_type="f", int_type="I"):
         self.uid_type = uid_type
         self.float_type = float_type
         self.int_type = int_type
+        self.uid_st = struct.Struct(uid_type)
+        self.float_st = struct.Struct(float_type)
+        self.int_st = struct.Struct(int_type)
+        self.uid_size = struct.calcsize(uid_type)
+        self.float_size = struct.calcsize(float_type)
+        self.int_size = struct.calcsize(int_type)
+        # native float layouts can be copied straight into a typed array
+        self.float_array = float_type if float_type in ("f", "d") else None
 
 # the format is machine-dependent.
 # this is for the current machine.
@@ -24,43 +47,77 @@ class MsbStream:
     def __init__(self, fp, fmt=default_format):
         self.fp = fp
         self.fmt = fmt
+        self.fpbuf_st = {}
+        self.data = None
+        self.pos = 0
+
+    # read from memory instead of a file, data is anything supporting the buffer protocol
+    @classmethod
+    def from_bytes(cls, data, fmt=default_format):
+        stream = cls(None, fmt)
+        stream.data = memoryview(data)
+        return stream
 
     def close(self):
-        self.fp.close()
+        if self.fp is not None:
+            self.fp.close()
 
     # -------------------
 
     def _read(self, sz):
-        buf = self.fp.read(sz)
+        if self.data is None:
+            buf = self.fp.read(sz)
+        else:
+            buf = self.data[self.pos:self.pos+sz]
+            self.pos += sz
         if len(buf) < sz:
             raise MsbEof
         return buf
 
-    def _unpack(self, fmt):
-        return struct.unpack(fmt, self._read(struct.calcsize(fmt)))
+    def _unpack(self, st, size):
+        if self.data is None:
+            return st.unpack(self._read(size))
+        if self.pos + size > len(self.data):
+            raise MsbEof
+        v = st.unpack_from(self.data, self.pos)
+        self.pos += size
+        return v
 
     def read_uid(self):
-        return self._unpack(self.fmt.uid_type)[0]
+        return self._unpack(self.fmt.uid_st, self.fmt.uid_size)[0]
 
     def read_float(self):
-        f = self._unpack(self.fmt.float_type)[0]
+        f = self._unpack(self.fmt.float_st, self.fmt.float_size)[0]
         if not math.isfinite(f):
             raise MsbError(f"Non-finite floating point: {f}")
         return f
 
     def read_fpint(self):
-        f = self.read_float()
-        i = int(f)
-        if i != f:
-            raise MsbError(f"Unexpected non-integer floating point: {f}")
-        return i
+        return fpint(self.read_float())
+
+    def _fpbuf_st(self, n):
+        # record sizes repeat a lot, so keep the n-float structs around
+        st = self.fpbuf_st.get(n)
+        if st is None:
+            t = self.fmt.float_type
+            st = self.fpbuf_st[n] = struct.Struct(f"{t[:-1]}{n}{t[-1]}")
+        return st
 
     def read_fpbuf(self, n):
-        buf = self._read(struct.calcsize(self.fmt.float_type) * n)
-        return (f for (f, ) in struct.iter_unpack(self.fmt.float_type, buf))
+        if n < 0:
+            # would read the rest of the file, or move backwards in memory
+            raise MsbError(f"Negative number of values: {n}")
+        if self.fmt.float_array:
+            buf = array(self.fmt.float_array)
+            buf.frombytes(self._read(self.fmt.float_size * n))
+        else:
+            st = self._fpbuf_st(n)
+            buf = st.unpack(self._read(st.size))
+        check_finite(buf)
+        return buf
 
     def read_int(self):
-        return self._unpack(self.fmt.int_type)[0]
+        return self._unpack(self.fmt.int_st, self.fmt.int_size)[0]
 
     # Note: this is not the same format as described in MELA manual
     # (turns out the actual format is different than the one in the manual)
@@ -90,7 +147,7 @@ class MsbStream:
         while nr < nv:
             typ = self.read_fpint()
             sz = self.read_fpint()
-            records.append(MsbLogicalRecord.from_floats(typ, list(self.read_fpbuf(sz))))
+            records.append(MsbLogicalRecord.from_floats(typ, self.read_fpbuf(sz)))
             nr += sz + 2 # count also typ and sz
 
         length2 = self.read_int()
@@ -102,41 +159,61 @@ class MsbStream:
 
     # -------------------
 
-    def _pack(self, fmt, *args):
-        self.fp.write(struct.pack(fmt, *args))
+    def _pack(self, st, *args):
+        self.fp.write(st.pack(*args))
 
     def write_uid(self, uid):
-        self._pack(self.fmt.uid_type, uid)
+        self._pack(self.fmt.uid_st, uid)
 
     def write_float(self, f):
         if not math.isfinite(f):
             raise MsbError(f"Non-finite floating point: {f}")
-        self._pack(self.fmt.float_type, f)
+        self._pack(self.fmt.float_st, f)
 
     def write_fpbuf(self, buf):
-        for f in buf:
-            self.write_float(f)
+        check_finite(buf)
+        if isinstance(buf, array) and buf.typecode == self.fmt.float_array:
+            self.fp.write(buf.tobytes())
+        else:
+            self._pack(self._fpbuf_st(len(buf)), *buf)
+
+    def pack_fpbuf_into(self, buf, off, fpbuf):
+        check_finite(fpbuf)
+        end = off + self.fmt.float_size * len(fpbuf)
+        if isinstance(fpbuf, array) and fpbuf.typecode == self.fmt.float_array:
+            buf[off:end] = fpbuf.tobytes()
+        else:
+            self._fpbuf_st(len(fpbuf)).pack_into(buf, off, *fpbuf)
+        return end
 
     def write_int(self, i):
-        self._pack(self.fmt.int_type, i)
+        self._pack(self.fmt.int_st, i)
 
     def write_physical_record(self, rec):
+        fmt = self.fmt
         records = [r.to_floats() for r in rec.records]
+        nv = sum(2 + len(r) for r in records) # type, numv, payload
 
-        length = struct.calcsize(self.fmt.uid_type) # uid
-        length += len(records) * struct.calcsize(self.fmt.int_type) # total numv
-        length += sum(2 + len(r) for r in records) * struct.calcsize(self.fmt.float_type) # type, numv, payload
+        length = fmt.uid_size + fmt.int_size + nv*fmt.float_size # uid, total numv, values
 
-        self.write_int(length)
-        self.write_uid(rec.uid)
-        self.write_int(sum(2 + len(r) for r in records))
+        # pack the whole record first, then hand it to the file in one write
+        buf = bytearray(length + 2*fmt.int_size)
+        fmt.int_st.pack_into(buf, 0, length)
+        off = fmt.int_size
+        fmt.uid_st.pack_into(buf, off, rec.uid)
+        off += fmt.uid_size
+        fmt.int_st.pack_into(buf, off, nv)
+        off += fmt.int_size
 
-        for r, buf in zip(rec.records, records):
-            self.write_float(r.record_type)
-            self.write_float(len(buf))
-            self.write_fpbuf(buf)
+        for r, fpbuf in zip(rec.records, records):
+            fmt.float_st.pack_into(buf, off, r.record_type)
+            off += fmt.float_size
+            fmt.float_st.pack_into(buf, off, len(fpbuf))
+            off += fmt.float_size
+            off = self.pack_fpbuf_into(buf, off, fpbuf)
 
-        self.write_int(length)
+        fmt.int_st.pack_into(buf, off, length)
+        self.fp.write(buf)
 
 def logical_record(typ, x):
     if typ == 1:
@@ -166,11 +243,16 @@ class MsbPhysicalRecord:
 
 class MsbLogicalRecord:
 
+    def __init__(self, record_type, buf):
+        self.record_type = record_type
+        # keep the payload as a flat typed array rather than a list of boxed floats
+        self.buf = buf if isinstance(buf, array) else array("d", buf)
+
     def to_floats(self):
         return self.buf
 
     def to_json(self):
-        return { "record_type": self.record_type, "buf": self.buf }
+        return { "record_type": self.record_type, "buf": self.buf.tolist() }
 
     @staticmethod
     def from_floats(typ, args):
@@ -187,7 +269,8 @@ class MsbLogicalRecord:
 # ---- msb reading & writing ----------------------------------------
 
 def read_msb(fp, fmt=default_format):
-    stream = MsbStream(fp, fmt)
+    # one read for the whole file, the records are then parsed from memory
+    stream = MsbStream.from_bytes(fp.read(), fmt)
 
     while True:
         rec = stream.read_physical_record()
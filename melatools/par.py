@@ -1,7 +1,7 @@
 from enum import IntEnum
 from collections import defaultdict
 from melatools.var import get_var
-from melatools.sym import finnish
+from melatools.sym import finnish, SymTable
 from melatools.record import Record, Value, IntValue, BoolValue, Constant
 
 class ParError(Exception):
@@ -23,15 +23,15 @@ class Par:
 
     def emit(self, out):
         if self.years is not None:
-            out.command("VUODET", *self.years)
+            out.command_raw(out.sym.VUODET, *self.years)
             out.newline()
 
         if self.output is not None:
-            out.command("TULOSTUS", *self.output.to_floats())
+            out.command_raw(out.sym.TULOSTUS, *self.output.to_floats())
             out.newline()
 
         if self.control is not None:
-            out.command("SIMULOINNIN_OHJAUS", *self.control.to_floats())
+            out.command_raw(out.sym.SIMULOINNIN_OHJAUS, *self.control.to_floats())
             out.newline()
 
         for e in self.events.values():
@@ -39,7 +39,7 @@ class Par:
             out.newline()
 
         for i in self.includes:
-            out.command("LUE", i)
+            out.command_raw(out.sym.LUE, i)
 
     def tostring(self, sym=finnish, line_wrap=130):
         out = ParWriter(sym, line_wrap)
@@ -103,16 +103,35 @@ class ParEventLinks:
                 par.events[id].feasible_precedessors = [
                         par.events[eid] if eid in par.events else EventRef(eid) for eid in prec]
 
+# (first line, continuation lines)
+_line_prefix = {
+    "command": ("", "    "),
+    "string":  ("#", "#>> "),
+    "comment": ("*", "*")
+}
+
 class ParWriter:
 
-    def __init__(self, sym, line_wrap=130):
-        self.sym = sym
+    def __init__(self, sym, line_wrap=130, fp=None):
+        self.sym = SymTable(sym)
         self.line_wrap = line_wrap
+        self.fp = fp
         self.buf = []
 
+    def write(self, s):
+        # stream straight into the file if we have one, otherwise collect for __str__
+        if self.fp is None:
+            self.buf.append(s)
+        else:
+            self.fp.write(s.encode("utf8"))
+
     def command(self, name, *params):
         self.emit(self.sym[name], *params, kind="command")
 
+    # name is already translated, eg. out.sym.VUODET
+    def command_raw(self, name, *params):
+        self.emit(name, *params, kind="command")
+
     def string(self, *s):
         self.emit(*s, kind="string")
 
@@ -120,65 +139,55 @@ class ParWriter:
         self.emit(*s, kind="comment")
 
     def newline(self):
-        self.buf.append("\n")
+        self.write("\n")
 
     def emit(self, *params, kind="command"):
+        first, cont = _line_prefix[kind]
+        remain = self.line_wrap - len(first)
         line = []
-        remain = self.line_wrap
-        first = None
-
-        if kind == "string":
-            remain -= 1
-            first = "#"
-        elif kind == "comment":
-            remain -= 1
-            first = "*"
 
         for p in map(str, params):
             if remain - 1 - len(p) <= 0:
                 if not line:
                     raise ParError(f"Parameter is too long to be line-wrapped: {p}")
 
-                if first:
-                    self.buf.append(first)
-                self.buf.extend(line)
-                self.buf.append("\n")
-
-                remain = self.line_wrap
+                self.write(first + " ".join(line) + "\n")
+                first = cont
+                remain = self.line_wrap - len(first)
                 line = []
 
-                if kind == "command":
-                    remain -= 4
-                    first = "    "
-                elif kind == "string":
-                    remain -= 4
-                    first = "#>> "
-                elif kind == "comment":
-                    remain -= 1
-                    first = "*"
-
             if line:
-                line.append(' ')
                 remain -= 1
 
             line.append(p)
             remain -= len(p)
 
         if line:
-            if first:
-                self.buf.append(first)
-            self.buf.extend(line)
-            self.buf.append("\n")
-
+            self.write(first + " ".join(line) + "\n")
 
     def __str__(self):
         return ''.join(self.buf)
 
-def write_par(fp, par, **kwargs):
-    fp.write(par.tostring(**kwargs).encode("utf8"))
+def write_par(fp, par, sym=finnish, line_wrap=130):
+    par.emit(ParWriter(sym, line_wrap, fp=fp))
 
 ##-- events ----------------------------------------
 
+def _event_ids(events):
+    return [e.id for e in events]
+
+# (attribute, json conversion, emit also when zero)
+_event_json_fields = (
+    ("years", None, False),
+    ("repeat_interval", None, True),
+    ("branching", None, False),
+    ("probability", None, False),
+    ("condition", lambda c: c.to_json(), False),
+    ("min_intervals", None, False),
+    ("comparable_events", _event_ids, False),
+    ("feasible_precedessors", _event_ids, False)
+)
+
 class EventMixin:
 
     def __init__(self):
@@ -198,62 +207,38 @@ class EventMixin:
         if self.repeat_interval is not None:
             years.append(self.repeat_interval)
         if years:
-            out.string(out.sym["TAPAHTUMAVUODET"], *years)
+            out.string(out.sym.TAPAHTUMAVUODET, *years)
 
         if self.branching:
-            out.string(out.sym["HAARAUTUMINEN"], *self.branching)
+            out.string(out.sym.HAARAUTUMINEN, *self.branching)
 
         if self.probability:
-            out.string(out.sym["TODENNAKOISYYS"], *self.probability)
+            out.string(out.sym.TODENNAKOISYYS, *self.probability)
 
         if self.condition:
-            out.string(out.sym["METSIKKOEHDOT"], *self.condition.to_floats())
+            out.string(out.sym.METSIKKOEHDOT, *self.condition.to_floats())
 
         if self.min_intervals:
-            out.string(out.sym["LYHIMMAT_TOTEUTUSVALIT"], *self.min_intervals)
+            out.string(out.sym.LYHIMMAT_TOTEUTUSVALIT, *self.min_intervals)
 
         if self.comparable_events:
-            out.string(out.sym["VASTAAVAT_TAPAHTUMAT"], *(e.id for e in self.comparable_events))
+            out.string(out.sym.VASTAAVAT_TAPAHTUMAT, *(e.id for e in self.comparable_events))
 
         if self.feasible_precedessors:
-            out.string(out.sym["SALLITUT_EDELTAJAT"], *(e.id for e in self.feasible_precedessors))
+            out.string(out.sym.SALLITUT_EDELTAJAT, *(e.id for e in self.feasible_precedessors))
 
     def to_json(self):
         out = {}
-
-        if self.years:
-            out["years"] = self.years
-
-        if self.repeat_interval is not None:
-            out["repeat_interval"] = self.repeat_interval
-
-        if self.branching:
-            out["branching"] = self.branching
-
-        if self.probability:
-            out["probability"] = self.probability
-
-        if self.condition:
-            out["condition"] = self.condition.to_json()
-
-        if self.min_intervals:
-            out["min_intervals"] = self.min_intervals
-
-        if self.comparable_events:
-            out["comparable_events"] = [e.id for e in self.comparable_events]
-
-        if self.feasible_precedessors:
-            out["feasible_precedessors"] = [e.id for e in self.feasible_precedessors]
-
+        for name, conv, keep_zero in _event_json_fields:
+            v = getattr(self, name)
+            if v or (keep_zero and v is not None):
+                out[name] = conv(v) if conv else v
         return out
 
     def from_json(self, d):
-        self.years = d.get("years")
-        self.repeat_interval = d.get("repeat_interval")
-        self.branching = d.get("branching")
-        self.probability = d.get("probability")
-        self.min_intervals = d.get("min_intervals")
-        
+        for name in ("years", "repeat_interval", "branching", "probability", "min_intervals"):
+            setattr(self, name, d.get(name))
+
         if "condition" in d:
             self.condition = DNFCondition.from_json(d["condition"])
 
@@ -271,14 +256,14 @@ class Event(EventMixin):
         return "%d %s" % (self.id, self.name)
 
     def emit(self, out):
-        out.command("TAPAHTUMA")
+        out.command_raw(out.sym.TAPAHTUMA)
         out.string(self.ident)
         out.comment("--------------------------------------------------------")
 
         EventMixin.emit(self, out)
 
         for c in self.calls:
-            out.string(out.sym["TAPAHTUMAKUTSU"], *c.to_floats())
+            out.string(out.sym.TAPAHTUMAKUTSU, *c.to_floats())
 
     def to_json(self):
         out = {
@@ -287,9 +272,6 @@ class Event(EventMixin):
             **EventMixin.to_json(self)
         }
 
-        if self.condition:
-            out["condition"] = self.condition.to_json()
-
         if self.calls:
             out["calls"] = [c.to_json() for c in self.calls]
 
@@ -313,7 +295,7 @@ class EventDefaults(EventMixin):
     id = "default"
 
     def emit(self, out):
-        out.command("TAPAHTUMA_OLETUSARVOT")
+        out.command_raw(out.sym.TAPAHTUMA_OLETUSARVOT)
         EventMixin.emit(self, out)
 
 class EventRef:
@@ -332,10 +314,12 @@ class DNFCondition:
         if not self.groups:
             return [0]
 
-        out = [x for c in self.groups[0] for x in c.to_floats()]
-        for g in self.groups[1:]:
-            out.append(0)
-            out.extend(x for c in g for x in c.to_floats())
+        out = []
+        for i, g in enumerate(self.groups):
+            if i:
+                out.append(0)
+            for c in g:
+                out.extend(c.to_floats())
 
         return out
 
@@ -344,42 +328,50 @@ class DNFCondition:
 
     @classmethod
     def from_floats(cls, args):
-        groups = []
-
-        # the whole dnf
-        while len(args) > 0:
-
-            # group
-            group = []
-            while len(args) > 0:
-
-                # definition
-                nv, args = int(args[0]), args[1:]
-                if nv == 0:
-                    # group separator
-                    break
-
-                var, cst = int(args[0]), args[1:nv]
-                c = []
-                while len(cst) > 0:
-                    if len(cst) > 1 and cst[1] < 0:
-                        c.append((cst[0], -cst[1]))
-                        cst = cst[2:]
-                    else:
-                        c.append(cst[0])
-                        cst = cst[1:]
-
-                args = args[nv:]
-                group.append(Constraint(get_var(var), c))
+        return cls([[Constraint(get_var(var), c) for var, c in g] for g in _scan_dnf(args)])
 
+    @classmethod
+    def from_json(cls, d):
+        return cls([[Constraint.from_json(c) for c in g] for g in d])
+
+# flat floats -> [[(var, values)]], one index walk over the whole dnf
+def _scan_dnf(args):
+    groups = []
+    group = []
+    i, n = 0, len(args)
+
+    while i < n:
+        # definition
+        nv = int(args[i])
+        i += 1
+        if nv == 0:
+            # group separator
             if group:
                 groups.append(group)
+                group = []
+            continue
+
+        end = i + nv
+        if end > n:
+            raise ValueError("Buffer overrun")
+
+        var = int(args[i])
+        i += 1
+        c = []
+        while i < end:
+            if i+1 < end and args[i+1] < 0:
+                c.append((args[i], -args[i+1]))
+                i += 2
+            else:
+                c.append(args[i])
+                i += 1
 
-        return cls(groups)
+        group.append((var, c))
 
-    @classmethod
-    def from_json(cls, d):
-        return cls([[Constraint.from_json(c) for c in g] for g in d])
+    if group:
+        groups.append(group)
+
+    return groups
 
 # logical OR
 class Constraint:
@@ -389,14 +381,16 @@ class Constraint:
         self.values = values
 
     def to_floats(self):
-        out = [self.var.id]
+        # out[0] is the length, filled in when we know it
+        out = [0, self.var.id]
         for c in self.values:
             if isinstance(c, (int, float)):
                 out.append(c)
             else:
                 out.append(c[0])
                 out.append(-c[1])
-        return [len(out), *out]
+        out[0] = len(out) - 1
+        return out
 
     def to_json(self):
         return [self.var.name, *self.values]
@@ -1,34 +1,22 @@
-# PAR file parsing, separate from par.py because of the lark dependency
+# PAR file parsing
 
 import sys
 import re
-import lark
 from melatools.par import Par, ParError, ParEventLinks, Event, EventDefaults, DNFCondition,\
         RoutineCall, Control, Output
 from melatools.sym import finnish
 
-# XXX: the include syntax is a hack and won't work for other syms.
-# blame MELA.
-grammar = r"""
-    start         : expr+
-    ?expr         : sysexpr | userexpr | include
-    sysexpr       : SYS_NAME parameter*
-    userexpr      : USER_NAME parameter*
-    include       : ("LUE" | "INCLUDE") /.+$/m
-    ?parameter    : string | number
-    string        : string_first string_cont*
-    number        : SIGNED_NUMBER
-    ?string_first : "#" /[^#\n]+/
-    ?string_cont  : "#>>" /[^#\n]+/
-    SYS_NAME      : /^[a-z]\w*/im
-    USER_NAME     : /^ [a-z]\w*/im
-    COMMENT.2     : /^[^ #a-z].*$/im
-
-    %import common.SIGNED_NUMBER
-    %import common.WS
-    %ignore WS
-    %ignore COMMENT
-"""
+# PAR files are line oriented, the first column decides what the line is:
+#
+#     NAME params...      system command
+#      NAME params...     user command (exactly one space)
+#     #string             string parameter of the current command
+#     #>> string          continuation of the previous string parameter
+#     (whitespace)        more parameters of the current command
+#     (anything else)     comment
+_CMD_RE = re.compile(r"( ?)([a-z]\w*)", re.I)
+_NUM_RE = re.compile(r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?")
+_STRING_RE = re.compile(r"#(>>)?\s*([^#]*)")
 
 class ParCmd:
 
@@ -40,15 +28,49 @@ class ParCmd:
     def __str__(self):
         return "%s %s" % (self.name, self.params)
 
-class ParTransformer(lark.Transformer):
-    start = list
-    sysexpr = lark.v_args(inline=True)(lambda self, name, *params: ParCmd("system", name, params))
-    userexpr = lark.v_args(inline=True)(lambda self, name, *params: ParCmd("user", name[1:], params))
-    include = lark.v_args(inline=True)(lambda self, fname: ParCmd("system", "LUE", [fname]))
-    string = lambda self, x: " ".join(x)
-    number = lark.v_args(inline=True)(float)
+def _parse(s):
+    cmds = []
+    cmd = None
+
+    for lineno, line in enumerate(s.splitlines(), 1):
+        m = _CMD_RE.match(line)
+        if m:
+            user, name, line = m.group(1), m.group(2), line[m.end():]
+            # XXX: the include syntax is a hack and won't work for other syms.
+            # blame MELA.
+            if not user and name in ("LUE", "INCLUDE"):
+                fname = line.lstrip()
+                if not fname:
+                    raise ParError(f"Missing include file name on line {lineno}")
+                cmds.append(ParCmd("system", "LUE", [fname]))
+                cmd = None
+                continue
+            cmd = ParCmd(user and "user" or "system", name, [])
+            cmds.append(cmd)
+        elif line and not line[0].isspace() and line[0] != "#":
+            # comment
+            continue
 
-_parse = lark.Lark(grammar, parser="lalr", transformer=ParTransformer()).parse
+        i = line.find("#")
+        nums = (line if i < 0 else line[:i]).split()
+        if cmd is None and (nums or i >= 0):
+            raise ParError(f"Parameters without a command on line {lineno}")
+
+        for x in nums:
+            if not _NUM_RE.fullmatch(x):
+                raise ParError(f"Unexpected '{x}' on line {lineno}")
+            cmd.params.append(float(x))
+
+        if i >= 0:
+            for m in _STRING_RE.finditer(line, i):
+                if m.group(1):
+                    if not cmd.params or not isinstance(cmd.params[-1], str):
+                        raise ParError(f"String continuation without a string on line {lineno}")
+                    cmd.params[-1] += " " + m.group(2)
+                else:
+                    cmd.params.append(m.group(2))
+
+    return cmds
 
 ##-- parsing ----------------------------------------
 
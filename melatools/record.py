@@ -1,3 +1,6 @@
+import sys
+from functools import lru_cache
+
 class Field:
 
     default = None
@@ -104,20 +107,153 @@ class EnumValue(Field):
     def encode(self, stream, v):
         stream.write(v)
 
+# decode plan opcodes. the common field kinds are decoded inline from the stream buffer,
+# anything else goes through its Field.decode.
+_FIELD = 0
+_VALUE = 1
+_INT   = 2 | _VALUE
+_OPT   = 4
+_SKIP  = 8 # AnyReserved, the value is only stepped over
+
+def _plan_op(f):
+    if type(f) is Optional:
+        op = _plan_op(f.field)
+        return op and op | _OPT
+    if type(f) is Value:
+        return _VALUE
+    if type(f) is IntValue:
+        return _INT
+    if type(f) is AnyReserved:
+        return _SKIP
+    return _FIELD
+
+class _Plan(tuple):
+
+    _decoder = None
+
+    # generated lazily, most plans are only ever used through decode_json
+    @property
+    def decoder(self):
+        if self._decoder is None:
+            self._decoder = _compile_decoder(self)
+        return self._decoder
+
+# (opcode, name, field, field's bound decode)
+def _compile_plan(fields):
+    return _Plan((_plan_op(f), name, f, f.decode) for name,f in fields)
+
+# the first n fields of a record class and their decode plan.
+# files only use a few different field counts, so these are worth keeping around.
+@lru_cache(maxsize=64)
+def field_prefix(record_cls, n):
+    return record_cls.fields[:n], _Plan(record_cls._plan[:n])
+
+# plans for explicitly given field lists
+@lru_cache(maxsize=64)
+def _fields_plan(fields):
+    return _compile_plan(fields)
+
+def _run_plan(plan, stream):
+    buf, pos = stream.buf, stream.pos
+    out = []
+    try:
+        for op, name, f, dec in plan:
+            if op:
+                v = buf[pos]
+                pos += 1
+                if op & _SKIP:
+                    v = None
+                elif op & _OPT and v == 0:
+                    v = None
+                elif op & _INT == _INT:
+                    i = int(v)
+                    if i != v:
+                        raise ValueError(f"Non-integer floating point: {v}")
+                    v = i
+            else:
+                stream.pos = pos
+                v = dec(stream)
+                pos = stream.pos
+            out.append(v)
+    except IndexError:
+        raise ValueError(f"Failed to decode {f} field {name}") from ValueError("Buffer overrun")
+    except Exception as e:
+        raise ValueError(f"Failed to decode {f} field {name}") from e
+    stream.pos = pos
+    return out
+
+def _compile_decoder(plan):
+    # straight-line code that decodes one record of the plan into r, with the buffer
+    # offsets of the inlined fields known up front. it doesn't bother with error
+    # messages, on failure the caller runs the plan again to find the bad field.
+    ns = {}
+    body = ["buf, pos = stream.buf, stream.pos"]
+    k = 0
+    skipped = False # reserved values past the last read, must still be in the buffer
+    for i,(op,name,_,dec) in enumerate(plan):
+        if op & _SKIP:
+            k += 1
+            skipped = True
+        elif op:
+            body.append(f"v = buf[pos+{k}]")
+            skipped = False
+            k += 1
+            ind = ""
+            if op & _OPT:
+                body.append("if v != 0:")
+                ind = "    "
+            if op & _INT == _INT:
+                body.append(f"{ind}i = int(v)")
+                body.append(f"{ind}if i != v: raise ValueError(v)")
+                body.append(f"{ind}r.{name} = i")
+            else:
+                body.append(f"{ind}r.{name} = v")
+        else:
+            if skipped:
+                body.append(f"if pos+{k} > len(buf): raise IndexError")
+                skipped = False
+            ns[f"_{i}"] = dec
+            body.append(f"stream.pos = pos+{k}")
+            body.append(f"v = _{i}(stream)")
+            body.append("if v is not None:")
+            body.append(f"    r.{name} = v")
+            body.append("pos = stream.pos")
+            k = 0
+    if skipped:
+        body.append(f"if pos+{k} > len(buf): raise IndexError")
+    body.append(f"stream.pos = pos+{k}")
+    exec("def decode(r, stream):" + "".join(f"\n    {l}" for l in body), ns)
+    return ns["decode"]
+
+def _record_init(fields):
+    # generated so that a new record is just a few slot stores
+    ns = dict((f"_{i}", f.default) for i,(_,f) in enumerate(fields))
+    body = "".join(f"\n    self.{n} = _{i}" for i,(n,_) in enumerate(fields))
+    exec(f"def __init__(self):{body or ' pass'}", ns)
+    return ns["__init__"]
+
 class RecordMeta(type):
 
     def __new__(cls, name, bases, attrs):
-        fields = [a for a in attrs.items() if isinstance(a[1], Field)]
-        for n,f in fields:
-            attrs[n] = f.default
+        fields = tuple((sys.intern(n), f) for n,f in attrs.items() if isinstance(f, Field))
+        for n,_ in fields:
+            if any(hasattr(b, n) for b in bases):
+                # the slot would hide it
+                raise TypeError(f"Field {name}.{n} shadows a Record attribute")
+            del attrs[n]
+        attrs["__slots__"] = tuple(n for n,_ in fields)
+        attrs["__init__"] = _record_init(fields)
         attrs["fields"] = fields
+        attrs["_encoders"] = tuple((n, f.encode) for n,f in fields)
+        attrs["_json_keys"] = tuple(n for n,f in fields if not f.ignore)
+        attrs["_plan"] = _compile_plan(fields)
         return type.__new__(cls, name, bases, attrs)
 
 class Record(metaclass=RecordMeta):
 
     def encode(self, stream):
-        for name,f in self.fields:
-            f.encode(stream, getattr(self, name, None))
+        for name,enc in self._encoders:
+            enc(stream, getattr(self, name))
 
     def to_floats(self):
         out = FpStream()
@@ -125,20 +261,59 @@ class Record(metaclass=RecordMeta):
         return out.buf
 
     def to_json(self):
-        return dict((n,getattr(self,n)) for n,_ in self.visible_fields if getattr(self,n) is not None)
+        out = {}
+        for n in self._json_keys:
+            v = getattr(self, n)
+            if v is not None:
+                out[n] = v
+        return out
+
+    @classmethod
+    def _plan_for(cls, fields):
+        return _fields_plan(tuple(fields)) if fields else cls._plan
 
     @classmethod
-    def decode(cls, stream, fields=None):
+    def _decode(cls, stream, plan):
+        if type(plan) is not _Plan:
+            plan = _Plan(plan)
         r = cls()
-        for name,f in fields or r.fields:
-            try:
-                v = f.decode(stream)
-            except Exception as e:
-                raise ValueError(f"Failed to decode {f} field {name}") from e
-            if v is not None:
-                setattr(r, name, v)
+        pos = stream.pos
+        try:
+            plan.decoder(r, stream)
+        except Exception:
+            # the generated decoder doesn't know which field failed, the plan does
+            stream.pos = pos
+            _run_plan(plan, stream)
+            raise
         return r
 
+    @classmethod
+    def decode(cls, stream, fields=None, plan=None):
+        return cls._decode(stream, plan if plan is not None else cls._plan_for(fields))
+
+    # same as decode(stream, fields).to_json(), but without building the record
+    @classmethod
+    def decode_json(cls, stream, fields=None, plan=None):
+        if plan is None:
+            plan = cls._plan_for(fields)
+        out = {}
+        for (_, name, f, _), v in zip(plan, _run_plan(plan, stream)):
+            if v is None:
+                v = f.default
+            if v is not None and not f.ignore:
+                out[name] = v
+        for name,f in cls.fields[len(plan):]:
+            if f.default is not None and not f.ignore:
+                out[name] = f.default
+        return out
+
+    # decode n consecutive records sharing the same (possibly truncated) field list
+    @classmethod
+    def decode_many(cls, stream, n, fields=None, plan=None):
+        if plan is None:
+            plan = cls._plan_for(fields)
+        return [cls._decode(stream, plan) for _ in range(n)]
+
     @classmethod
     def from_floats(cls, args, fields=None):
         return cls.decode(FpStream(args), fields=fields)
@@ -160,14 +335,18 @@ class Record(metaclass=RecordMeta):
 
 class FpStream:
 
-    def __init__(self, buf=None):
+    def __init__(self, buf=None, pos=0):
         self.buf = buf or []
+        self.pos = pos
+
+    def remaining(self):
+        return len(self.buf) - self.pos
 
     def next(self, peek=False):
-        if len(self.buf) > 0:
-            v = self.buf[0]
+        if self.pos < len(self.buf):
+            v = self.buf[self.pos]
             if not peek:
-                self.buf = self.buf[1:]
+                self.pos += 1
             return v
         raise ValueError("Buffer overrun")
 
@@ -178,6 +357,17 @@ class FpStream:
             raise ValueError(f"Non-integer floating point: {f}")
         return i
 
+    # the next n floats as one slice of the buffer
+    def nextn(self, n):
+        if n < 0:
+            raise ValueError(f"Negative number of values: {n}")
+        end = self.pos + n
+        if end > len(self.buf):
+            raise ValueError("Buffer overrun")
+        v = self.buf[self.pos:end]
+        self.pos = end
+        return v
+
     def write(self, f):
         self.buf.append(float(f))
 
@@ -1,4 +1,6 @@
-from melatools.record import FpStream, Record, Value, IntValue, Optional, Constant, AnyReserved
+from array import array
+from collections.abc import MutableSequence
+from melatools.record import field_prefix, FpStream, Record, Value, IntValue, Optional, Constant, AnyReserved
 
 class RsdSamplePlot(Record):
     id                        = IntValue() # 1
@@ -55,43 +57,206 @@ class RsdTree(Record):
     management_category       = Optional(IntValue()) # 16
     _17                       = AnyReserved() # 17
 
+# columns that are always written as zero, whatever was read
+_tree_reserved = tuple(i for i,(_,f) in enumerate(RsdTree.fields) if type(f) is AnyReserved)
+
+# columns that must hold integers (0 for a missing optional is one too)
+_tree_int = tuple(i for i,(_,f) in enumerate(RsdTree.fields)
+                  if type(f) is IntValue or (type(f) is Optional and type(f.field) is IntValue))
+
+def _tree_columns(trees):
+    return dict((n, array("d", (getattr(t, n) or 0 for t in trees))) for n in RsdTree._json_keys)
+
+# The trees of an initial data record, kept as the raw float block they were read from.
+# A tree is decoded when it's first accessed, and stays decoded (so changes to it stick).
+# Changing the sequence itself decodes everything and drops the block, after that this
+# is just a list of trees.
+class RsdTrees(MutableSequence):
+
+    def __init__(self, buf, start, nt, ntv):
+        self.buf = buf
+        self.start = start
+        self.ntv = ntv
+        self.fields, self.plan = field_prefix(RsdTree, ntv)
+        self.trees = [None] * nt
+        self.decoded = 0
+
+    def __len__(self):
+        return len(self.trees)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.trees)))]
+        t = self.trees[i]
+        if t is None:
+            if i < 0:
+                i += len(self.trees)
+            t = RsdTree.decode(FpStream(self.buf, self.start + i*self.ntv), plan=self.plan)
+            self.trees[i] = t
+            self.decoded += 1
+        return t
+
+    def _detach(self):
+        if self.buf is not None:
+            self.trees = list(self)
+            self.decoded = len(self.trees)
+            self.buf = None
+
+    def __setitem__(self, i, t):
+        self._detach()
+        self.trees[i] = t
+
+    def __delitem__(self, i):
+        self._detach()
+        del self.trees[i]
+
+    def insert(self, i, t):
+        self._detach()
+        self.trees.insert(i, t)
+
+    def __iter__(self):
+        if self.buf is not None and not self.decoded:
+            # nothing touched yet, walk the whole block in one go
+            stream = FpStream(self.buf, self.start)
+            self.trees = RsdTree.decode_many(stream, len(self.trees), plan=self.plan)
+            self.decoded = len(self.trees)
+        for i in range(len(self.trees)):
+            yield self[i]
+
+    def to_floats(self):
+        ntv = self.ntv
+        if self.buf is None or ntv != len(RsdTree.fields):
+            # no block to copy from, or truncated rows that are written out with the full schema
+            out = array("d")
+            for t in self:
+                out.extend(t.to_floats())
+            return out
+
+        # full schema: the block is already laid out as written, only decoded trees
+        # (which may have been changed) need to be encoded again.
+        out = array("d", self.buf[self.start:self.start + len(self.trees)*ntv])
+        # the copied rows were never decoded, so do the check decoding would have done
+        for j in _tree_int:
+            if not all(map(float.is_integer, out[j::ntv])):
+                list(self) # decoding the rows raises the proper error
+        for i,t in enumerate(self.trees):
+            if t is not None:
+                out[i*ntv:(i+1)*ntv] = array("d", t.to_floats())
+        zeros = array("d", bytes(8*len(self.trees)))
+        for j in _tree_reserved:
+            out[j::ntv] = zeros
+        return out
+
+    # column name -> array("d") of the column, taken from the float block as strided slices.
+    # trees that have been decoded may have changed, their values come from the objects.
+    # the keys are always those of the full schema, columns past ntv hold the defaults.
+    def columns(self):
+        if self.buf is None:
+            return _tree_columns(self.trees)
+        nt, ntv = len(self.trees), self.ntv
+        start, end = self.start, self.start + nt*ntv
+        decoded = [(i,t) for i,t in enumerate(self.trees) if t is not None]
+        out = {}
+        for j,(n,f) in enumerate(RsdTree.fields):
+            if f.ignore:
+                continue
+            if j < ntv:
+                col = array("d", self.buf[start+j:end:ntv])
+            else:
+                col = array("d", (f.default or 0,)) * nt
+            for i,t in decoded:
+                col[i] = getattr(t, n) or 0
+            out[n] = col
+        return out
+
+    # the json dicts one tree at a time, for consumers that only iterate.
+    # rows nobody has touched go straight from floats to json, no tree objects needed
+    def iter_json(self):
+        stream = FpStream(self.buf, self.start)
+        for t in self.trees:
+            if t is None:
+                yield RsdTree.decode_json(stream, plan=self.plan)
+            else:
+                yield t.to_json()
+                stream.pos += self.ntv
+
+    # json.dumps only takes real lists, so this one has to build all of them
+    def to_json(self):
+        return list(self.iter_json())
+
 class RsdInitialDataRecord:
 
-    record_type = 1
+    record_type = 1 # fixed, msb readers dispatch on it
 
     def __init__(self, plot=None, trees=None):
         self.plot = plot or RsdSamplePlot()
         self.trees = trees or []
 
+    # a flat array('d') rather than a list of boxed floats
     def to_floats(self):
-        return [
-            len(RsdSamplePlot.fields),
-            *self.plot.to_floats(),
-            len(self.trees),
-            len(RsdTree.fields),
-            *(f for t in self.trees for f in t.to_floats())
-        ]
+        out = array("d", (len(RsdSamplePlot.fields),))
+        out.extend(self.plot.to_floats())
+        out.append(len(self.trees))
+        out.append(len(RsdTree.fields))
+        if not self.trees:
+            # plenty of plots have none
+            return out
+        if isinstance(self.trees, RsdTrees):
+            out.extend(self.trees.to_floats())
+        else:
+            for t in self.trees:
+                out.extend(t.to_floats())
+        return out
+
+    # the trees column by column (missing values are 0, as in the file)
+    @property
+    def tree_columns(self):
+        if isinstance(self.trees, RsdTrees):
+            return self.trees.columns()
+        return _tree_columns(self.trees)
 
     def to_json(self):
         return {
-            "record_type": self.record_type,
+            "record_type": 1,
             **self.plot.to_json(),
-            "trees": [t.to_json() for t in self.trees]
+            "trees": self.trees.to_json() if isinstance(self.trees, RsdTrees) else [t.to_json() for t in self.trees]
         }
 
     @classmethod
     def from_floats(cls, buf):
+        return cls.decode(FpStream(buf))
+
+    # any number of records laid out back to back in one buffer
+    @classmethod
+    def from_floats_batch(cls, buf):
         stream = FpStream(buf)
+        out = []
+        while stream.remaining() > 0:
+            out.append(cls.decode(stream))
+        return out
+
+    @classmethod
+    def decode(cls, stream):
         nv = stream.nextint()
+        if nv < 0:
+            raise ValueError(f"Negative number of sample plot fields: {nv}")
         if nv > len(RsdSamplePlot.fields):
             raise ValueError(f"Given {nv} sample plot fields but only have {len(RsdSamplePlot.fields)}")
 
-        plot = RsdSamplePlot.decode(stream, fields=RsdSamplePlot.fields[:nv])
+        _, plan = field_prefix(RsdSamplePlot, nv)
+        plot = RsdSamplePlot.decode(stream, plan=plan)
 
         nt = stream.nextint()
         ntv = stream.nextint()
 
-        trees = [RsdTree.decode(stream, fields=RsdTree.fields[:ntv]) for _ in range(nt)]
+        if nt < 0 or ntv < 0:
+            raise ValueError(f"Negative tree block size: {nt} trees of {ntv} fields")
+        if ntv > len(RsdTree.fields):
+            raise ValueError(f"Given {ntv} tree fields but only have {len(RsdTree.fields)}")
+        if stream.remaining() < nt*ntv:
+            raise ValueError(f"Buffer overrun: {nt} trees of {ntv} fields")
+
+        trees = RsdTrees(stream.nextn(nt*ntv), 0, nt, ntv)
         return cls(plot, trees)
 
     @classmethod
@@ -3,3 +3,18 @@ class Finnish:
         return x
 
 finnish = Finnish()
+
+class SymTable:
+    # names as attributes, translated through the wrapped sym on first use only
+    def __init__(self, sym):
+        self._sym = sym
+
+    def __getitem__(self, x):
+        return self._sym[x]
+
+    def __getattr__(self, x):
+        if x.startswith("_"):
+            raise AttributeError(x)
+        v = self._sym[x]
+        setattr(self, x, v)
+        return v
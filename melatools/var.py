@@ -4,13 +4,23 @@ class Var:
         self.id = id
         self.name = name
 
+# vars are only ever built from their id, so one instance per id will do
+_vars = {}
+
 def get_var(x):
-    if isinstance(x, str):
-        if x[:3] == "var":
+    t = type(x)
+    if t is str:
+        if len(x) > 3 and x.startswith("var"):
             x = int(x[3:])
         else:
             return None # TODO lookup
+    elif t is float:
+        x = int(x)
+    elif t is not int:
+        return None
 
-    if isinstance(x, float) or isinstance(x, int):
+    v = _vars.get(x)
+    if v is None:
         # TODO lookup
-        return Var(int(x), f"var{x}")
+        v = _vars[x] = Var(x, f"var{x}")
+    return v